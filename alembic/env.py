@@ -5,6 +5,7 @@ from sqlalchemy import pool
 
 from alembic import context
 
+from config import DATABASE_URI
 from models import Base
 
 # this is the Alembic Config object, which provides
@@ -15,6 +16,9 @@ config = context.config
 # This line sets up loggers basically.
 fileConfig(config.config_file_name)
 
+# one DATABASE_URI for the app, models.py and migrations
+config.set_main_option("sqlalchemy.url", DATABASE_URI.replace("%", "%%"))
+
 # add your model's MetaData object here
 # for 'autogenerate' support
 # from myapp import mymodel
@@ -0,0 +1,34 @@
+"""Idempotency keys
+
+Revision ID: 3c1f9b7d2a64
+Revises: eaee571a9c41
+Create Date: 2026-10-17 19:05:12.481903
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c1f9b7d2a64'
+down_revision = 'eaee571a9c41'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # only used with IDEMPOTENCY_STORE = 'database'
+    op.create_table('IdempotencyKey',
+    sa.Column('key', sa.VARCHAR(length=64), nullable=False),
+    sa.Column('fingerprint', sa.VARCHAR(length=64), nullable=False),
+    sa.Column('status', sa.INTEGER(), nullable=True),
+    sa.Column('body', sa.TEXT(), nullable=True),
+    sa.Column('expiresAt', sa.DATETIME(), nullable=False),
+    sa.PrimaryKeyConstraint('key')
+    )
+    op.create_index('ix_IdempotencyKey_expiresAt', 'IdempotencyKey', ['expiresAt'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_IdempotencyKey_expiresAt', table_name='IdempotencyKey')
+    op.drop_table('IdempotencyKey')
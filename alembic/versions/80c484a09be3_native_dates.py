@@ -0,0 +1,90 @@
+"""Native dates
+
+Revision ID: 80c484a09be3
+Revises: e6bff9ddf460
+Create Date: 2026-10-17 11:48:02.914570
+
+"""
+import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '80c484a09be3'
+down_revision = 'e6bff9ddf460'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+
+# the API wrote unpadded '2021-1-5' strings, the models.py seed wrote ctime()
+DATE_FORMATS = ('%Y-%m-%d', '%a %b %d %H:%M:%S %Y')
+
+
+def _parse(value):
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value.strip(), fmt).date()
+        except ValueError:
+            pass
+    raise ValueError(f"Unrecognized date {value!r}")
+
+
+def _fill(conn, t, pk, column, new_column):
+    # copy parsed dates into rows whose new column is still empty, batch by batch over the primary key
+    update = t.update().where(t.c[pk] == sa.bindparam('_pk')).values({new_column: sa.bindparam('_date')})
+    last = 0
+    while True:
+        rows = conn.execute(
+            sa.select(t.c[pk], t.c[column]).where(t.c[pk] > last, t.c[new_column].is_(None))
+            .order_by(t.c[pk]).limit(BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        conn.execute(update, [{'_pk': row[0], '_date': _parse(row[1])} for row in rows])
+        last = rows[-1][0]
+
+
+def _convert(table, pk, column):
+    # fill a new DATE column, then swap it in
+    new_column = column + 'New'
+    op.add_column(table, sa.Column(new_column, sa.DATE(), nullable=True))
+
+    t = sa.table(table, sa.column(pk), sa.column(column), sa.column(new_column))
+    context = op.get_context()
+    # every batch commits on its own, so the running app only ever waits on one batch's rows
+    with context.autocommit_block():
+        _fill(op.get_bind(), t, pk, column, new_column)
+    # catch up on rows the running app inserted during the first pass
+    with context.autocommit_block():
+        _fill(op.get_bind(), t, pk, column, new_column)
+
+    missing = op.get_bind().execute(
+        sa.select(sa.func.count()).select_from(t).where(t.c[new_column].is_(None))).scalar()
+    if missing:
+        raise RuntimeError(f"{missing} {table} rows have no {new_column}; pause writes to {table} and rerun")
+
+    # NOT NULL first, so nothing is dropped unless every row converted
+    with op.batch_alter_table(table) as batch_op:
+        batch_op.alter_column(new_column, existing_type=sa.DATE(), nullable=False)
+    with op.batch_alter_table(table) as batch_op:
+        batch_op.drop_column(column)
+        batch_op.alter_column(new_column, new_column_name=column, existing_type=sa.DATE(), existing_nullable=False)
+
+
+def upgrade():
+    _convert('Loan', 'loanId', 'createdDate')
+    _convert('Payment', 'paymentId', 'paidDate')
+    op.create_index('ix_Loan_userId_createdDate', 'Loan', ['userId', 'createdDate'])
+    op.create_index('ix_Payment_loanId_paidDate', 'Payment', ['loanId', 'paidDate'])
+
+
+def downgrade():
+    op.drop_index('ix_Payment_loanId_paidDate', table_name='Payment')
+    op.drop_index('ix_Loan_userId_createdDate', table_name='Loan')
+    with op.batch_alter_table('Payment') as batch_op:
+        batch_op.alter_column('paidDate', type_=sa.VARCHAR(length=255), existing_type=sa.DATE(), existing_nullable=False)
+    with op.batch_alter_table('Loan') as batch_op:
+        batch_op.alter_column('createdDate', type_=sa.VARCHAR(length=255), existing_type=sa.DATE(), existing_nullable=False)
@@ -0,0 +1,36 @@
+"""Last login and audit events
+
+Revision ID: 9b2e4c7a1f03
+Revises: 3c1f9b7d2a64
+Create Date: 2026-10-17 21:14:37.208315
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9b2e4c7a1f03'
+down_revision = '3c1f9b7d2a64'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # both only written with WRITE_BEHIND enabled
+    op.add_column('User', sa.Column('lastLoginAt', sa.DATETIME(), nullable=True))
+    op.create_table('AuditEvent',
+    sa.Column('eventId', sa.INTEGER(), nullable=False),
+    sa.Column('userId', sa.INTEGER(), nullable=False),
+    sa.Column('event', sa.VARCHAR(length=32), nullable=False),
+    sa.Column('remoteAddr', sa.VARCHAR(length=45), nullable=True),
+    sa.Column('createdAt', sa.DATETIME(), nullable=False),
+    sa.PrimaryKeyConstraint('eventId')
+    )
+    op.create_index('ix_AuditEvent_userId', 'AuditEvent', ['userId'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_AuditEvent_userId', table_name='AuditEvent')
+    op.drop_table('AuditEvent')
+    op.drop_column('User', 'lastLoginAt')
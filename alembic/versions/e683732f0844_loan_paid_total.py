@@ -0,0 +1,29 @@
+"""Loan paid total
+
+Revision ID: e683732f0844
+Revises: 5dd00ded9d84
+Create Date: 2026-10-17 10:12:41.532118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e683732f0844'
+down_revision = '5dd00ded9d84'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('Loan', sa.Column('paidTotal', sa.INTEGER(), nullable=False, server_default='0'))
+    # backfill the running balance from the payments already recorded
+    op.execute(
+        'UPDATE Loan SET paidTotal = '
+        '(SELECT COALESCE(SUM(Payment.amount), 0) FROM Payment WHERE Payment.loanId = Loan.loanId)'
+    )
+
+
+def downgrade():
+    op.drop_column('Loan', 'paidTotal')
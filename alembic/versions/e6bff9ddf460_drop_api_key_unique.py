@@ -0,0 +1,25 @@
+"""Drop api_key unique
+
+Revision ID: e6bff9ddf460
+Revises: e683732f0844
+Create Date: 2026-10-17 11:04:19.270311
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e6bff9ddf460'
+down_revision = 'e683732f0844'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # tokens are no longer stored per login, the unique index on VARCHAR(512) only costs writes
+    op.drop_constraint('api_key', 'User', type_='unique')
+
+
+def downgrade():
+    op.create_unique_constraint('api_key', 'User', ['api_key'])
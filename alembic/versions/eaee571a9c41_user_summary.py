@@ -0,0 +1,35 @@
+"""User summary
+
+Revision ID: eaee571a9c41
+Revises: 80c484a09be3
+Create Date: 2026-10-17 14:21:37.604118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'eaee571a9c41'
+down_revision = '80c484a09be3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # rows are built lazily on the first GET /user/<userId>/summary
+    op.create_table('UserSummary',
+    sa.Column('userId', sa.INTEGER(), nullable=False),
+    sa.Column('totalBorrowed', sa.INTEGER(), nullable=False),
+    sa.Column('totalPaid', sa.INTEGER(), nullable=False),
+    sa.Column('outstanding', sa.INTEGER(), nullable=False),
+    sa.Column('openLoans', sa.INTEGER(), nullable=False),
+    sa.Column('paidLoans', sa.INTEGER(), nullable=False),
+    sa.Column('nextDue', sa.DECIMAL(precision=14, scale=2), nullable=False),
+    sa.ForeignKeyConstraint(['userId'], ['User.userId'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('userId')
+    )
+
+
+def downgrade():
+    op.drop_table('UserSummary')
@@ -0,0 +1,409 @@
+"""Async (ASGI) variant of the loan API.
+
+Serves the same user, login/logout, loan and payment routes and JSON
+contracts as main.create_app, but on an async SQLAlchemy engine, with
+bcrypt awaited on the hashing pool, so a slow client or a slow query no
+longer pins a server thread. Tokens are interchangeable with the sync app.
+
+    hypercorn --bind 127.0.0.1:8080 "asgi:create_asgi_app()"
+"""
+import datetime
+import functools
+import uuid
+
+import jwt as pyjwt
+from marshmallow import ValidationError
+from quart import Quart, g, jsonify, request
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+import summary
+from cache import CurrentUser, TTLCache, RevocationStore
+from config import ASYNC_DATABASE_URI, SECRET_KEY, engine_options
+from hashing import PasswordHasher, HashingBusy
+from models import User, Loan, Payment, apply_payment
+from schemas import UserSchema, UserDisplaySchema, LoanSchema, LoanDisplaySchema, PaymentSchema, PaymentDisplaySchema
+
+TOKEN_EXPIRES = datetime.timedelta(minutes=30)
+
+
+def create_access_token(identity, secret):
+    # same claims and signature as flask_jwt_extended, so tokens work on both apps
+    now = datetime.datetime.now(datetime.timezone.utc)
+    claims = {"fresh": False, "iat": now, "jti": str(uuid.uuid4()), "type": "access", "sub": identity,
+              "nbf": now, "exp": now + TOKEN_EXPIRES}
+    return pyjwt.encode(claims, secret, algorithm="HS256")
+
+
+def create_asgi_app(config=None):
+    app = Quart(__name__)
+    app.config['SECRET_KEY'] = SECRET_KEY
+    app.config['DATABASE_URI'] = ASYNC_DATABASE_URI
+    app.config['TOKEN_PERSIST_API_KEY'] = False
+    app.config['TOKEN_REVOCATION_STORE'] = None
+    app.config['USER_CACHE_SIZE'] = 1024
+    app.config['USER_CACHE_TTL'] = 60
+    app.config['BCRYPT_LOG_ROUNDS'] = 12
+    app.config['HASH_WORKERS'] = None
+    app.config['HASH_MAX_PENDING'] = 64
+    app.config['HASH_RETRY_AFTER'] = 1
+    app.config['PAGE_SIZE'] = 50
+    app.config['PAGE_SIZE_MAX'] = 500
+    if config:
+        app.config.update(config)
+
+    uri = app.config['DATABASE_URI']
+    engine = create_async_engine(uri, **engine_options(uri))
+    Session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    hasher = PasswordHasher(rounds=app.config['BCRYPT_LOG_ROUNDS'], workers=app.config['HASH_WORKERS'],
+                            max_pending=app.config['HASH_MAX_PENDING'])
+    app.extensions['hasher'] = hasher
+
+    user_schema = UserSchema()
+    user_display_schema = UserDisplaySchema()
+    loan_schema = LoanSchema()
+    loan_display_schema = LoanDisplaySchema()
+    payment_schema = PaymentSchema()
+    payments_display_schema = PaymentDisplaySchema(many=True)
+    loans_display_schema = LoanDisplaySchema(many=True, exclude=("payments",))
+
+    revocation_store = app.config['TOKEN_REVOCATION_STORE']
+    if revocation_store is None:
+        revocation_store = RevocationStore()
+    user_cache = TTLCache(maxsize=app.config['USER_CACHE_SIZE'], ttl=app.config['USER_CACHE_TTL'])
+    app.extensions['revocation_store'] = revocation_store
+    app.extensions['user_cache'] = user_cache
+
+    @app.before_request
+    async def open_session():
+        g.session = Session()
+
+    @app.teardown_request
+    async def close_session(exc):
+        if 'session' in g:
+            await g.session.close()
+
+    @app.after_serving
+    async def dispose_engine():
+        await engine.dispose()
+        hasher.shutdown()
+
+    def jwt_required(view):
+        # mirrors flask_jwt_extended's header/query-string lookup and error bodies
+        @functools.wraps(view)
+        async def wrapper(*args, **kwargs):
+            header = request.headers.get('Authorization', '')
+            token = header[7:] if header.startswith('Bearer ') else request.args.get('jwt')
+            if not token:
+                return jsonify(msg="Missing Authorization Header"), 401
+            try:
+                claims = pyjwt.decode(token, app.config['SECRET_KEY'], algorithms=["HS256"])
+            except pyjwt.ExpiredSignatureError:
+                return jsonify(msg="Token has expired"), 401
+            except pyjwt.InvalidTokenError as e:
+                return jsonify(msg=str(e)), 422
+            if claims.get('type') != 'access':
+                return jsonify(msg="Only non-refresh tokens are allowed"), 422
+            if revocation_store.is_revoked(claims['jti']):
+                return jsonify(msg="Token has been revoked"), 401
+            g.jwt = claims
+            return await view(*args, **kwargs)
+        return wrapper
+
+    async def load_current_user():
+        identity = g.jwt['sub']
+        current_user = user_cache.get(identity)
+        if current_user is None:
+            row = (await g.session.execute(
+                select(User.userId, User.phone, User.isAdmin).filter_by(phone=identity))).first()
+            if row is None:
+                return None
+            current_user = CurrentUser(*row)
+            user_cache.set(identity, current_user)
+        return current_user
+
+    def date_range_filter(column):
+        criteria = []
+        if request.args.get('from'):
+            criteria.append(column >= datetime.date.fromisoformat(request.args['from']))
+        if request.args.get('to'):
+            criteria.append(column <= datetime.date.fromisoformat(request.args['to']))
+        return criteria
+
+    async def paginate(statement, key):
+        limit = min(int(request.args.get('limit', app.config['PAGE_SIZE'])), app.config['PAGE_SIZE_MAX'])
+        if limit < 1:
+            raise ValueError("limit must be positive")
+        if request.args.get('after'):
+            statement = statement.where(key > int(request.args['after']))
+        rows = (await g.session.execute(statement.order_by(key).limit(limit + 1))).scalars().all()
+        next_cursor = getattr(rows[limit - 1], key.key) if len(rows) > limit else None
+        return rows[:limit], next_cursor
+
+    def page_response(result, next_cursor):
+        response = jsonify(result)
+        if next_cursor is not None:
+            response.headers['X-Next-Cursor'] = str(next_cursor)
+        return response, 200
+
+    @app.errorhandler(HashingBusy)
+    async def hashing_busy(e):
+        response = jsonify({"message": "Service is busy, try again later"})
+        response.headers['Retry-After'] = str(app.config['HASH_RETRY_AFTER'])
+        return response, 503
+
+    @app.route("/user", methods=["POST"])
+    async def create_user():
+        session = g.session
+        try:
+            data = user_schema.load(await request.get_json())
+            if not data['phone'].isdecimal(): return jsonify({"message": "Invalid parameters"}), 400
+
+            data['password'] = await hasher.generate_async(data['password'])
+            data['api_key'] = create_access_token(data['phone'], app.config['SECRET_KEY'])
+
+            # the unique index on phone rejects duplicates, no SELECT beforehand
+            user = User(**data)
+            session.add(user)
+            try:
+                await session.commit()
+            except IntegrityError as e:
+                print(e.orig)
+                await session.rollback()
+                return jsonify({"message": "User with this phone already exists"}), 409
+            return jsonify(userId=user.userId), 201
+        except ValidationError as e:
+            print(e)
+            return jsonify({"message": "Invalid parameters"}), 400
+
+    @app.route("/user/login", methods=["GET"])
+    async def user_login():
+        session = g.session
+        try:
+            auth = request.authorization
+            if not auth or not auth.username or not auth.password:
+                return jsonify({"message": "Invalid parameters"}), 400
+
+            user = (await session.execute(select(User).filter_by(phone=auth.username))).scalar()
+            if user is None:
+                return jsonify({"message": "User not found"}), 404
+            if not await hasher.check_async(user.password, auth.password):
+                return jsonify({"message": "Incorrect user credentials"}), 401
+            api_key = create_access_token(auth.username, app.config['SECRET_KEY'])
+            if hasher.needs_rehash(user.password):
+                user.password = await hasher.generate_async(auth.password)
+            if app.config['TOKEN_PERSIST_API_KEY']:
+                user.api_key = api_key
+                user_cache.pop(user.phone)
+            if session.dirty:
+                await session.commit()
+            return jsonify(userId=user.userId, api_key=api_key), 200
+        except HashingBusy:
+            raise
+        except Exception as e:
+            print(e)
+            return jsonify({"message": "Invalid parameters"}), 400
+
+    @app.route("/user/logout", methods=["GET"])
+    @jwt_required
+    async def logout():
+        current_user = await load_current_user()
+        try:
+            if current_user is None:
+                return jsonify({"message": "Not found"}), 404
+
+            revocation_store.revoke(g.jwt['jti'], g.jwt['exp'])
+            if app.config['TOKEN_PERSIST_API_KEY']:
+                user = await g.session.get(User, current_user.userId)
+                user.api_key = ''
+                await g.session.commit()
+            user_cache.pop(current_user.phone)
+            return jsonify({"message": "Success"}), 200
+        except:
+            return jsonify({"message": "Invalid parameters"}), 400
+
+    @app.route("/user/<userId>", methods=["GET", "DELETE"])
+    @jwt_required
+    async def get_user(userId):
+        session = g.session
+        current_user = await load_current_user()
+        try:
+            uid = int(userId)
+        except ValueError:
+            return jsonify({"message": "Invalid parameters"}), 400
+
+        user = await session.get(User, uid)
+        if user is None:
+            return jsonify({"message": "User not found"}), 404
+
+        if request.method == "GET":
+            if user.userId != current_user.userId and not current_user.isAdmin:
+                return jsonify({"message": "Forbidden!"}), 403
+            result = user_display_schema.dump(user)
+            return jsonify(result), 200
+
+        elif request.method == "DELETE":
+            try:
+                if current_user is None:
+                    return jsonify({"message": "Incorrect user credentials"}), 401
+                if user.userId != current_user.userId and not current_user.isAdmin:
+                    return jsonify({"message": "Forbidden!"}), 403
+                phone = user.phone
+                await session.delete(user)
+                await session.commit()
+                user_cache.pop(phone)
+                return jsonify({"message": "Success"}), 200
+            except:
+                return jsonify({"message": "Invalid parameters"}), 400
+
+    @app.route("/user/<userId>/loans", methods=["GET"])
+    @jwt_required
+    async def get_user_loans(userId):
+        current_user = await load_current_user()
+        try:
+            try:
+                uid = int(userId)
+            except ValueError:
+                return jsonify({"message": "Invalid parameters"}), 400
+
+            if current_user is None:
+                return jsonify({"message": "Incorrect user credentials"}), 401
+            if uid != current_user.userId and not current_user.isAdmin:
+                return jsonify({"message": "Forbidden!"}), 403
+
+            loans, next_cursor = await paginate(
+                select(Loan).where(Loan.userId == uid, *date_range_filter(Loan.createdDate)), Loan.loanId)
+            result = loans_display_schema.dump(loans)
+            return page_response(result, next_cursor)
+        except Exception as e:
+            print(e)
+            return jsonify({"message": "Invalid parameters"}), 400
+
+    @app.route("/loan", methods=["POST"])
+    @jwt_required
+    async def loan_post():
+        session = g.session
+        current_user = await load_current_user()
+        try:
+            data = loan_schema.load(await request.get_json())
+
+            if current_user is None:
+                return jsonify({"message": "Incorrect user credentials"}), 401
+
+            data['createdDate'] = datetime.date.fromtimestamp(data['createdDate'])
+            data['userId'] = current_user.userId
+
+            loan = Loan(**data)
+            session.add(loan)
+            await session.execute(summary.apply_loan(loan.userId, loan.amount, loan.months, loan.isPaid))
+            await session.commit()
+            return jsonify({"loanId": loan.loanId}), 200
+        except:
+            return jsonify({"message": "Invalid parameters"}), 400
+
+    @app.route("/loan/<loanId>", methods=["GET"])
+    @jwt_required
+    async def get_loan(loanId):
+        current_user = await load_current_user()
+        try:
+            try:
+                id = int(loanId)
+            except ValueError:
+                return jsonify({"message": "Invalid parameters"}), 400
+
+            include_payments = request.args.get('include') == 'payments'
+            columns = [Loan.loanId, Loan.amount, Loan.isPaid, Loan.createdDate, Loan.months, Loan.userId,
+                       Payment.paymentId]
+            if include_payments:
+                columns += [Payment.amount.label('paymentAmount'), Payment.paidDate]
+            rows = (await g.session.execute(
+                select(*columns).outerjoin(Payment, Payment.loanId == Loan.loanId)
+                .where(Loan.loanId == id).order_by(Payment.paymentId))).all()
+            if not rows:
+                return jsonify({"message": "Loan not found"}), 404
+            loan = rows[0]
+            if loan.userId != current_user.userId and not current_user.isAdmin:
+                return jsonify({"message": "Forbidden!"}), 403
+
+            result = loan_display_schema.dump(loan)
+            if include_payments:
+                result['payments'] = payments_display_schema.dump(
+                    {"paymentId": r.paymentId, "amount": r.paymentAmount, "paidDate": r.paidDate, "loanId": r.loanId}
+                    for r in rows if r.paymentId is not None)
+            else:
+                result['payments'] = [r.paymentId for r in rows if r.paymentId is not None]
+
+            return jsonify(result), 200
+        except:
+            return jsonify({"message": "Invalid parameters"}), 400
+
+    @app.route("/pay/<loanId>", methods=["POST"])
+    @jwt_required
+    async def pay_loan(loanId):
+        session = g.session
+        current_user = await load_current_user()
+        try:
+            try:
+                id = int(loanId)
+            except ValueError:
+                return jsonify({"message": "Invalid parameters"}), 400
+
+            data = payment_schema.load(await request.get_json())
+
+            loan = await session.get(Loan, id, with_for_update=True)
+            if loan is None:
+                return jsonify({"message": "Loan not found"}), 404
+
+            if loan.isPaid:
+                return jsonify({"message": "Invalid parameters - Loan is paid"}), 400
+
+            if current_user is None:
+                return jsonify({"message": "User not found"}), 404
+
+            if current_user.userId != loan.userId:
+                return jsonify({"message": "No permissions"}), 401
+
+            data['paidDate'] = datetime.date.fromtimestamp(data['paidDate'])
+            data['loanId'] = id
+
+            if (await session.execute(apply_payment(id, data['amount']))).rowcount == 0:
+                await session.rollback()
+                return jsonify({"message": "Invalid parameters - Loan is paid"}), 400
+            payment = Payment(**data)
+            session.add(payment)
+            await session.execute(summary.apply_payment(loan, data['amount']))
+            await session.commit()
+
+            return jsonify({"paymentId": payment.paymentId}), 200
+        except Exception as e:
+            print(e)
+            return jsonify({"message": "Invalid parameters"}), 400
+
+    @app.route("/pay/<loanId>", methods=["GET"])
+    @jwt_required
+    async def get_payment(loanId):
+        current_user = await load_current_user()
+        try:
+            try:
+                id = int(loanId)
+            except ValueError:
+                return jsonify({"message": "Invalid parameters"}), 400
+
+            loan = await g.session.get(Loan, id)
+            if loan is None:
+                return jsonify({"message": "Payments not found"}), 404
+            if loan.userId != current_user.userId and not current_user.isAdmin:
+                return jsonify({"message": "Forbidden!"}), 403
+
+            payment, next_cursor = await paginate(
+                select(Payment).where(Payment.loanId == id, *date_range_filter(Payment.paidDate)),
+                Payment.paymentId)
+            result = payments_display_schema.dump(payment)
+            return page_response(result, next_cursor)
+        except Exception as e:
+            print(e)
+            return jsonify({"message": "Invalid parameters"}), 400
+
+    return app
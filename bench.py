@@ -0,0 +1,382 @@
+"""Load test for the loan API.
+
+Seeds a synthetic dataset into DATABASE_URI, serves create_app() with
+waitress in-process and drives a mix of login/loan/payment traffic at each
+concurrency level, then prints throughput, p50/p95/p99 latency and
+queries per request for every endpoint.
+
+    DATABASE_URI=sqlite:////tmp/bench.sqlite python bench.py --reset --concurrency 1,8,32
+
+With --workers the same mix runs against prefork.py once per worker count,
+which shows how throughput scales with processes; queries per request then
+come from the summed /metrics of the workers. Use MySQL for those numbers,
+sqlite serializes writers across processes.
+
+    python bench.py --uri mysql://... --reset --workers 1,2,4 --concurrency 32
+
+--race N instead fires N simultaneous payments at one new loan that only
+half of them can pay off, and exits non-zero unless exactly that half was
+accepted, the recorded payments add up to the loan amount and the server
+handled at least --min-rate payments per second.
+
+    python bench.py --uri mysql://... --reset --race 400 --threads 16 --min-rate 100
+
+The repo has no test suite; run --race in CI to gate changes to the payment path.
+
+Use a throwaway database: --reset drops every table first.
+"""
+import argparse
+import base64
+import contextlib
+import datetime
+import http.client
+import json
+import math
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+
+import bcrypt
+from flask import has_request_context, request
+from sqlalchemy import create_engine, event, select
+from waitress import wasyncore
+from waitress.server import create_server
+
+from config import DATABASE_URI, engine_options
+from models import Base, User, Loan, Payment
+from main import create_app
+
+PASSWORD = 'bench-password'
+CHUNK = 1000
+PREFORK = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'prefork.py')
+
+# endpoint -> weight of the request mix
+MIX = {
+    'GET /user/login': 5,
+    'POST /loan': 5,
+    'GET /loan/<loanId>': 45,
+    'GET /pay/<loanId>': 35,
+    'POST /pay/<loanId>': 10,
+}
+
+
+def _insert(connection, table, rows):
+    for i in range(0, len(rows), CHUNK):
+        connection.execute(table.insert(), rows[i:i + CHUNK])
+
+
+def seed(uri, users, loans, payments, rounds, reset):
+    engine = create_engine(uri, **engine_options(uri))
+    if reset:
+        Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+
+    password = bcrypt.hashpw(PASSWORD.encode('utf-8'), bcrypt.gensalt(rounds))
+    today = datetime.date.today()
+    started = time.perf_counter()
+    with engine.begin() as connection:
+        first = connection.execute(select(User.userId).order_by(User.userId.desc())).scalar() or 0
+        _insert(connection, User.__table__, [
+            dict(phone=str(380000000000 + first + i), password=password, firstName='Bench', lastName='User',
+                 age=30, monthlyEarnings=1000, occupation='bench', api_key='', isAdmin=False)
+            for i in range(1, users + 1)])
+        user_ids = {row.userId: row.phone for row in connection.execute(
+            select(User.userId, User.phone).where(User.userId > first))}
+
+        first_loan = connection.execute(select(Loan.loanId).order_by(Loan.loanId.desc())).scalar() or 0
+        _insert(connection, Loan.__table__, [
+            dict(amount=payments * 10 + 100000, isPaid=False, createdDate=today, months=12,
+                 userId=user_id, paidTotal=payments * 10)
+            for user_id in user_ids for _ in range(loans)])
+        accounts = defaultdict(list)
+        for loan_id, user_id in connection.execute(select(Loan.loanId, Loan.userId).where(Loan.loanId > first_loan)):
+            accounts[user_ids[user_id]].append(loan_id)
+
+        _insert(connection, Payment.__table__, [
+            dict(amount=10, paidDate=today, loanId=loan_id)
+            for loan_ids in accounts.values() for loan_id in loan_ids for _ in range(payments)])
+    print(f"seeded {users} users, {users * loans} loans, {users * loans * payments} payments "
+          f"in {time.perf_counter() - started:.1f}s")
+    engine.dispose()
+    return dict(accounts)
+
+
+def count_queries(app):
+    # statements issued per endpoint, counted inside the server
+    counts = defaultdict(int)
+    lock = threading.Lock()
+
+    def before_cursor_execute(*args):
+        if has_request_context() and request.url_rule is not None:
+            with lock:
+                counts[f"{request.method} {request.url_rule.rule}"] += 1
+
+    with app.app_context():
+        engines = [app.extensions['sqlalchemy'].db.engine]
+    if app.extensions['read_replicas'] is not None:
+        engines += app.extensions['read_replicas'].engines
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    return counts
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def scrape(metrics_port):
+    # statements per endpoint and ready workers from the prefork /metrics
+    connection = http.client.HTTPConnection('127.0.0.1', metrics_port, timeout=10)
+    connection.request('GET', '/metrics')
+    text = connection.getresponse().read().decode()
+    connection.close()
+    counts, ready = {}, 0
+    for line in text.splitlines():
+        match = re.match(r'db_queries_per_request_sum\{method="(.*?)",endpoint="(.*?)"\} (\S+)$', line)
+        if match:
+            counts[f"{match[1]} {match[2]}"] = float(match[3])
+        elif line.startswith('prefork_workers '):
+            ready = int(line.split()[1])
+    return counts, ready
+
+
+@contextlib.contextmanager
+def prefork_server(uri, workers, threads, rounds):
+    port, metrics_port = free_port(), free_port()
+    process = subprocess.Popen(
+        [sys.executable, PREFORK, '--port', str(port), '--workers', str(workers), '--threads', str(threads),
+         '--metrics-port', str(metrics_port), '--set', f'BCRYPT_LOG_ROUNDS={rounds}'],
+        env=dict(os.environ, DATABASE_URI=uri), stdout=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + 60
+        while True:
+            try:
+                if scrape(metrics_port)[1] == workers:
+                    break
+            except OSError:
+                pass
+            if process.poll() is not None or time.monotonic() > deadline:
+                raise RuntimeError(f"prefork.py did not start {workers} workers")
+            time.sleep(0.2)
+        yield port, metrics_port
+    finally:
+        process.terminate()
+        process.wait()
+
+
+@contextlib.contextmanager
+def inprocess_server(uri, threads, rounds):
+    app = create_app({'SQLALCHEMY_DATABASE_URI': uri,
+                      'SQLALCHEMY_ENGINE_OPTIONS': engine_options(uri),
+                      'BCRYPT_LOG_ROUNDS': rounds})
+    server = create_server(app, host='127.0.0.1', port=0, threads=threads)
+    threading.Thread(target=server.run, daemon=True).start()
+    try:
+        yield server.effective_port, count_queries(app)
+    finally:
+        # close the listener from the loop thread; server.close() would pull the trigger out from under it
+        server.trigger.pull_trigger(lambda: wasyncore.dispatcher.close(server))
+        server.task_dispatcher.shutdown()
+
+
+class Client:
+    def __init__(self, port, phone, loan_ids):
+        self.connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        self.phone = phone
+        self.loan_ids = loan_ids
+        self.token = None
+
+    def request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        if self.token:
+            headers['Authorization'] = 'Bearer ' + self.token
+        if body is not None:
+            body = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        self.connection.request(method, path, body, headers)
+        response = self.connection.getresponse()
+        return response.status, response.read()
+
+    def login(self):
+        credentials = base64.b64encode(f"{self.phone}:{PASSWORD}".encode()).decode()
+        self.token = None
+        status, body = self.request('GET', '/user/login', headers={'Authorization': 'Basic ' + credentials})
+        if status == 200:
+            self.token = json.loads(body)['api_key']
+        return status
+
+    def call(self, endpoint):
+        loan_id = random.choice(self.loan_ids)
+        now = int(time.time())
+        if endpoint == 'GET /user/login':
+            return self.login()
+        if endpoint == 'POST /loan':
+            status, body = self.request('POST', '/loan', dict(amount=1000, isPaid=False, createdDate=now, months=12))
+            if status == 200:
+                self.loan_ids.append(json.loads(body)['loanId'])
+            return status
+        if endpoint == 'GET /loan/<loanId>':
+            return self.request('GET', f'/loan/{loan_id}')[0]
+        if endpoint == 'GET /pay/<loanId>':
+            return self.request('GET', f'/pay/{loan_id}')[0]
+        return self.request('POST', f'/pay/{loan_id}', dict(amount=1, paidDate=now))[0]
+
+
+def run_level(port, accounts, concurrency, duration):
+    endpoints, weights = zip(*MIX.items())
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+    phones = random.sample(list(accounts), min(concurrency, len(accounts)))
+
+    def worker(phone):
+        client = Client(port, phone, list(accounts[phone]))
+        client.login()
+        local = defaultdict(list)
+        failed = defaultdict(int)
+        while time.perf_counter() < deadline:
+            endpoint = random.choices(endpoints, weights)[0]
+            started = time.perf_counter()
+            try:
+                status = client.call(endpoint)
+            except (OSError, http.client.HTTPException):
+                client.connection.close()
+                status = None
+            local[endpoint].append(time.perf_counter() - started)
+            if status not in (200, 201):
+                failed[endpoint] += 1
+        with lock:
+            for endpoint, values in local.items():
+                latencies[endpoint].extend(values)
+            for endpoint, n in failed.items():
+                errors[endpoint] += n
+
+    threads = [threading.Thread(target=worker, args=(phones[i % len(phones)],)) for i in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors, time.perf_counter() - started
+
+
+def race(port, accounts, payments, min_rate, amount=10):
+    # every payment waits on a barrier, so they reach the server together
+    phone = next(iter(accounts))
+    owner = Client(port, phone, [])
+    owner.login()
+    loan_amount = payments // 2 * amount
+    now = int(time.time())
+    loan_id = json.loads(owner.request(
+        'POST', '/loan', dict(amount=loan_amount, isPaid=False, createdDate=now, months=12))[1])['loanId']
+
+    statuses = defaultdict(int)
+    lock = threading.Lock()
+    barrier = threading.Barrier(payments)
+
+    def pay():
+        client = Client(port, phone, [loan_id])
+        client.token = owner.token
+        barrier.wait()
+        try:
+            status = client.request('POST', f'/pay/{loan_id}', dict(amount=amount, paidDate=now))[0]
+        except (OSError, http.client.HTTPException):
+            status = None
+        with lock:
+            statuses[status] += 1
+
+    threads = [threading.Thread(target=pay) for _ in range(payments)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    paid, after = 0, 0
+    while True:
+        page = json.loads(owner.request('GET', f'/pay/{loan_id}?limit=500&after={after}')[1])
+        if not page:
+            break
+        paid += sum(payment['amount'] for payment in page)
+        after = page[-1]['paymentId']
+    loan = json.loads(owner.request('GET', f'/loan/{loan_id}')[1])
+    exact = statuses[200] == loan_amount // amount and paid == loan_amount and loan['isPaid']
+    rate = payments / elapsed
+    print(f"race: {payments} payments in {elapsed:.2f}s ({rate:.1f}/s), statuses {dict(statuses)}, "
+          f"paid {paid} of {loan_amount}: {'exact' if exact else 'WRONG'}"
+          + ("" if rate >= min_rate else f", below --min-rate {min_rate:g}/s"))
+    return exact and rate >= min_rate
+
+
+def percentile(values, p):
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def report(label, latencies, errors, elapsed, queries):
+    total = sum(len(values) for values in latencies.values())
+    print(f"\n{label}: {total / elapsed:.1f} req/s, {sum(errors.values())} errors")
+    print(f"{'endpoint':<22}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'queries':>10}")
+    for endpoint in MIX:
+        values = sorted(latencies.get(endpoint, []))
+        if not values:
+            continue
+        print(f"{endpoint:<22}{len(values):>8}"
+              + "".join(f"{percentile(values, p) * 1000:>10.2f}" for p in (50, 95, 99))
+              + f"{queries.get(endpoint, 0) / len(values):>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--uri', default=DATABASE_URI)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--loans', type=int, default=5, help="loans per user")
+    parser.add_argument('--payments', type=int, default=20, help="payments per loan")
+    parser.add_argument('--concurrency', default='1,8,32', help="comma separated client counts")
+    parser.add_argument('--duration', type=float, default=10, help="seconds per concurrency level")
+    parser.add_argument('--threads', type=int, default=8, help="waitress threads (per worker with --workers)")
+    parser.add_argument('--workers', help="comma separated worker counts to run prefork.py with")
+    parser.add_argument('--rounds', type=int, default=12, help="bcrypt cost")
+    parser.add_argument('--reset', action='store_true', help="drop and recreate all tables before seeding")
+    parser.add_argument('--race', type=int, help="check N simultaneous payments to one loan instead of the mix")
+    parser.add_argument('--min-rate', type=float, default=20, help="payments per second --race must reach")
+    args = parser.parse_args()
+
+    accounts = seed(args.uri, args.users, args.loans, args.payments, args.rounds, args.reset)
+    levels = [int(c) for c in args.concurrency.split(',')]
+    if args.race:
+        servers = [prefork_server(args.uri, int(w), args.threads, args.rounds) for w in args.workers.split(',')] \
+            if args.workers else [inprocess_server(args.uri, args.threads, args.rounds)]
+        passed = True
+        for server in servers:
+            with server as (port, _):
+                passed = race(port, accounts, args.race, args.min_rate) and passed
+        sys.exit(0 if passed else 1)
+    if args.workers:
+        for workers in (int(w) for w in args.workers.split(',')):
+            with prefork_server(args.uri, workers, args.threads, args.rounds) as (port, metrics_port):
+                for concurrency in levels:
+                    before = scrape(metrics_port)[0]
+                    latencies, errors, elapsed = run_level(port, accounts, concurrency, args.duration)
+                    queries = {k: v - before.get(k, 0) for k, v in scrape(metrics_port)[0].items()}
+                    report(f"workers {workers}, concurrency {concurrency}", latencies, errors, elapsed, queries)
+        return
+
+    with inprocess_server(args.uri, args.threads, args.rounds) as (port, queries):
+        for concurrency in levels:
+            queries.clear()
+            latencies, errors, elapsed = run_level(port, accounts, concurrency, args.duration)
+            report(f"concurrency {concurrency}", latencies, errors, elapsed, queries)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""Micro-benchmark of response serialization for the hot read paths.
+
+Times the marshmallow display schemas + jsonify against the row serializers
++ json_response on the same in-memory data, and checks that both produce the
+same bytes.
+
+    python bench_serializers.py --payments 1000 --repeat 200
+"""
+import argparse
+import datetime
+import time
+
+from flask import jsonify
+
+from main import create_app
+from models import Base, User, Loan, Payment
+from schemas import UserDisplaySchema, LoanDisplaySchema, PaymentDisplaySchema
+from serializers import USER_DISPLAY, LOAN_DISPLAY, PAYMENT_DISPLAY, json_response
+
+
+def setup(db, payments):
+    Base.metadata.create_all(db.engine)
+    today = datetime.date.today()
+    user = User(phone='380630000000', password=b'-' * 60, firstName='Bench', lastName='User', age=30,
+                monthlyEarnings=1000, occupation='bench', api_key='', isAdmin=False)
+    db.session.add(user)
+    db.session.flush()
+    loan = Loan(amount=payments * 10, isPaid=False, createdDate=today, months=12, userId=user.userId)
+    db.session.add(loan)
+    db.session.flush()
+    db.session.execute(Payment.__table__.insert(),
+                       [dict(amount=10, paidDate=today, loanId=loan.loanId) for _ in range(payments)])
+    db.session.commit()
+    return user.userId, loan.loanId
+
+
+def timed(repeat, func):
+    body = func()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - started) / repeat, body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--payments', type=int, default=1000, help="payments on the benchmarked loan")
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://', 'SQLALCHEMY_ENGINE_OPTIONS': {}})
+    db = app.extensions['sqlalchemy'].db
+    user_display_schema = UserDisplaySchema()
+    loan_display_schema = LoanDisplaySchema()
+    payments_display_schema = PaymentDisplaySchema(many=True)
+
+    with app.test_request_context():
+        user_id, loan_id = setup(db, args.payments)
+        query = db.session.query
+
+        def user_schema():
+            return jsonify(user_display_schema.dump(query(User).filter_by(userId=user_id).first())).get_data()
+
+        def user_rows():
+            row = query(*USER_DISPLAY.columns).filter(User.userId == user_id).first()
+            return json_response(USER_DISPLAY.one(row)).get_data()
+
+        def loan_schema():
+            rows = query(Loan.loanId, Loan.amount, Loan.isPaid, Loan.createdDate, Loan.months, Loan.userId,
+                         Payment.paymentId).outerjoin(Payment, Payment.loanId == Loan.loanId) \
+                .filter(Loan.loanId == loan_id).order_by(Payment.paymentId).all()
+            result = loan_display_schema.dump(rows[0])
+            result['payments'] = [r.paymentId for r in rows if r.paymentId is not None]
+            return jsonify(result).get_data()
+
+        def loan_rows():
+            rows = query(*LOAN_DISPLAY.columns, Payment.paymentId).outerjoin(Payment, Payment.loanId == Loan.loanId) \
+                .filter(Loan.loanId == loan_id).order_by(Payment.paymentId).all()
+            payments = [r.paymentId for r in rows if r.paymentId is not None]
+            return json_response(LOAN_DISPLAY.one(rows[0], payments)).get_data()
+
+        def payments_schema():
+            payments = query(Payment).filter(Payment.loanId == loan_id).order_by(Payment.paymentId).all()
+            body = jsonify(payments_display_schema.dump(payments)).get_data()
+            db.session.expunge_all()
+            return body
+
+        def payments_rows():
+            payments = query(*PAYMENT_DISPLAY.columns).filter(Payment.loanId == loan_id) \
+                .order_by(Payment.paymentId).all()
+            return json_response(PAYMENT_DISPLAY.many(payments)).get_data()
+
+        print(f"{'path':<16}{'marshmallow ms':>16}{'rows ms':>10}{'speedup':>10}  output")
+        for name, slow, fast in [("GET /user", user_schema, user_rows), ("GET /loan", loan_schema, loan_rows),
+                                 ("GET /pay", payments_schema, payments_rows)]:
+            slow_time, slow_body = timed(args.repeat, slow)
+            fast_time, fast_body = timed(args.repeat, fast)
+            print(f"{name:<16}{slow_time * 1000:>16.3f}{fast_time * 1000:>10.3f}{slow_time / fast_time:>9.1f}x  "
+                  + ("identical" if slow_body == fast_body else "DIFFERENT"))
+
+
+if __name__ == '__main__':
+    main()
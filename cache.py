@@ -0,0 +1,159 @@
+import json
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict, namedtuple
+
+# what the protected routes need of the logged in user, cached by JWT identity
+CurrentUser = namedtuple("CurrentUser", ["userId", "phone", "isAdmin"])
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after `ttl` seconds."""
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[1] < time.monotonic():
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def _set(self, key, value, ttl):
+        self._data[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+        self._data.move_to_end(key)
+        while self.maxsize is not None and len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._set(key, value, ttl)
+
+    def add(self, key, value, ttl=None):
+        # set only if absent (or expired), like redis SET NX
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and item[1] >= time.monotonic():
+                return False
+            self._set(key, value, ttl)
+            return True
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, None)
+        return default if item is None else item[0]
+
+    def purge(self):
+        now = time.monotonic()
+        with self._lock:
+            for key in [k for k, (_, expires) in self._data.items() if expires < now]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._data), "maxsize": self.maxsize, "ttl": self.ttl,
+                    "hits": self.hits, "misses": self.misses}
+
+
+class RevocationStore:
+    """Revoked JWT ids, each kept only until the token it belongs to expires.
+
+    Anything exposing `revoke(jti, expires_at)` and `is_revoked(jti)` can be
+    plugged in instead, e.g. a store shared between workers.
+    """
+
+    def __init__(self, purge_interval=60):
+        self.purge_interval = purge_interval
+        self._revoked = TTLCache(maxsize=None)
+        self._last_purge = time.monotonic()
+
+    def revoke(self, jti, expires_at):
+        ttl = expires_at - time.time()
+        if ttl > 0:
+            self._revoked.set(jti, True, ttl=ttl)
+        if time.monotonic() - self._last_purge > self.purge_interval:
+            self._last_purge = time.monotonic()
+            self._revoked.purge()
+
+    def is_revoked(self, jti):
+        return self._revoked.get(jti, False)
+
+    def __len__(self):
+        return len(self._revoked)
+
+
+class RedisBackend:
+    """ResponseCache backend on any redis-py compatible client (redis.Redis, fakeredis.FakeRedis)."""
+
+    def __init__(self, client, ttl=300, prefix="ap4:"):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key, default=None):
+        raw = self.client.get(self.prefix + key)
+        return default if raw is None else json.loads(raw)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, json.dumps(value), ex=int(ttl or self.ttl))
+
+    def add(self, key, value, ttl=None):
+        return bool(self.client.set(self.prefix + key, json.dumps(value), ex=int(ttl or self.ttl), nx=True))
+
+    def pop(self, key, default=None):
+        self.client.delete(self.prefix + key)
+        return default
+
+
+class ResponseCache:
+    """Serialized loan responses, keyed by a per-loan version token.
+
+    Every change to a loan drops its version, which orphans all responses
+    cached under it. The backend needs get/set/add/pop: TTLCache for a
+    single process, RedisBackend when several workers must agree.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def version(self, loan_id):
+        key = f"loan:{loan_id}"
+        version = self.backend.get(key)
+        if version is None:
+            version = uuid.uuid4().hex[:16]
+            if not self.backend.add(key, version):
+                version = self.backend.get(key) or version
+        return version
+
+    def bump(self, *loan_ids):
+        for loan_id in loan_ids:
+            self.backend.pop(f"loan:{loan_id}")
+
+    def get(self, loan_id, version, variant):
+        return self.backend.get(f"loan:{loan_id}:{version}:{variant}")
+
+    def set(self, loan_id, version, variant, owner, body, headers):
+        entry = {"owner": owner, "etag": f"{version}-{zlib.crc32(variant.encode()):08x}",
+                 "body": body, "headers": headers}
+        self.backend.set(f"loan:{loan_id}:{version}:{variant}", entry)
+        return entry
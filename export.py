@@ -0,0 +1,93 @@
+"""Streaming export of loans or payments as NDJSON or CSV.
+
+Rows are read through a server-side cursor and written CHUNK at a time, so
+memory stays flat however large the tables are.
+
+    python export.py payments --format csv --from 2021-10-01 --to 2021-10-31 > payments.csv
+    python export.py loans --user 42
+
+Admins get the same output from GET /admin/export.
+"""
+import argparse
+import csv
+import datetime
+import io
+import json
+import sys
+
+from sqlalchemy import create_engine, select
+
+from config import DATABASE_URI, engine_options
+from models import Loan, Payment
+
+CHUNK = 1000
+FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+DATE_COLUMNS = {"loans": Loan.createdDate, "payments": Payment.paidDate}
+
+_encoder = json.JSONEncoder(separators=(",", ":"), default=lambda value: value.isoformat())
+
+
+def query(table, *criteria):
+    if table == "loans":
+        statement = select(Loan.loanId, Loan.userId, Loan.amount, Loan.paidTotal, Loan.isPaid, Loan.createdDate,
+                           Loan.months).order_by(Loan.loanId)
+    else:
+        statement = select(Payment.paymentId, Payment.loanId, Loan.userId, Payment.amount, Payment.paidDate) \
+            .join(Loan, Loan.loanId == Payment.loanId).order_by(Payment.paymentId)
+    return statement.where(*criteria)
+
+
+def _csv_value(value):
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    return value
+
+
+def stream(engine, statement, format):
+    """Yields the export as text chunks; the first one is sent before the bulk of the rows is read."""
+    with engine.connect() as connection:
+        result = connection.execution_options(stream_results=True).execute(statement)
+        columns = list(result.keys())
+        if format == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer, lineterminator="\n")
+            writer.writerow(columns)
+            yield buffer.getvalue()
+            for rows in result.partitions(CHUNK):
+                buffer.seek(0)
+                buffer.truncate()
+                writer.writerows([_csv_value(value) for value in row] for row in rows)
+                yield buffer.getvalue()
+        else:
+            for rows in result.partitions(CHUNK):
+                yield "".join(_encoder.encode(dict(zip(columns, row))) + "\n" for row in rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('table', choices=sorted(DATE_COLUMNS))
+    parser.add_argument('--format', choices=sorted(FORMATS), default='ndjson')
+    parser.add_argument('--from', dest='date_from', type=datetime.date.fromisoformat, help="YYYY-MM-DD, inclusive")
+    parser.add_argument('--to', dest='date_to', type=datetime.date.fromisoformat, help="YYYY-MM-DD, inclusive")
+    parser.add_argument('--user', type=int, help="only this userId")
+    parser.add_argument('--uri', default=DATABASE_URI)
+    args = parser.parse_args()
+
+    criteria = []
+    if args.date_from:
+        criteria.append(DATE_COLUMNS[args.table] >= args.date_from)
+    if args.date_to:
+        criteria.append(DATE_COLUMNS[args.table] <= args.date_to)
+    if args.user is not None:
+        criteria.append(Loan.userId == args.user)
+
+    engine = create_engine(args.uri, **engine_options(args.uri))
+    for chunk in stream(engine, query(args.table, *criteria), args.format):
+        sys.stdout.write(chunk)
+    engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+import asyncio
+import hmac
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import bcrypt
+
+
+class HashingBusy(Exception):
+    """Raised when the hashing pool already has `max_pending` jobs queued."""
+
+
+def _secret(password):
+    # bcrypt only ever used the first 72 bytes; bcrypt 5 raises on longer input instead of cutting it
+    return password.encode('utf-8')[:72]
+
+
+def _generate(password, rounds):
+    return bcrypt.hashpw(_secret(password), bcrypt.gensalt(rounds))
+
+
+def _check(pw_hash, password):
+    return hmac.compare_digest(bcrypt.hashpw(_secret(password), pw_hash), pw_hash)
+
+
+def _context():
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+class PasswordHasher:
+    """Runs bcrypt in a process pool so request threads are not pinned by hashing."""
+
+    def __init__(self, rounds=12, workers=None, max_pending=64):
+        self.rounds = rounds
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    # created from a request thread: fork would copy locks other threads hold
+                    self._executor = ProcessPoolExecutor(self.workers, mp_context=_context())
+        return self._executor
+
+    def _submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusy()
+        try:
+            future = self._pool().submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def generate(self, password):
+        return self._submit(_generate, password, self.rounds).result()
+
+    def check(self, pw_hash, password):
+        return self._submit(_check, bytes(pw_hash), password).result()
+
+    async def generate_async(self, password):
+        return await asyncio.wrap_future(self._submit(_generate, password, self.rounds))
+
+    async def check_async(self, pw_hash, password):
+        return await asyncio.wrap_future(self._submit(_check, bytes(pw_hash), password))
+
+    def needs_rehash(self, pw_hash):
+        # bcrypt hashes look like $2b$12$..., the cost sits between the 2nd and 3rd '$'
+        try:
+            return int(bytes(pw_hash).split(b'$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
@@ -0,0 +1,95 @@
+import datetime
+import time
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+
+from cache import TTLCache
+from models import IdempotencyKey
+
+
+class IdempotencyStore:
+    """Responses of requests sent with an Idempotency-Key, for one process.
+
+    `begin(key, fingerprint)` claims the key and returns None to the single
+    caller that should run the request; everyone else gets the stored
+    (fingerprint, status, body), with status None while the first request is
+    still running. A claim that is never completed expires after `lock_ttl`.
+    """
+
+    def __init__(self, ttl=86400, lock_ttl=60, maxsize=100000):
+        self.ttl = ttl
+        self.lock_ttl = lock_ttl
+        self._records = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def begin(self, key, fingerprint):
+        while True:
+            if self._records.add(key, (fingerprint, None, None), ttl=self.lock_ttl):
+                return None
+            record = self._records.get(key)
+            if record is not None:
+                return record
+
+    def complete(self, key, fingerprint, status, body):
+        self._records.set(key, (fingerprint, status, body), ttl=self.ttl)
+
+    def release(self, key):
+        self._records.pop(key)
+
+
+class DatabaseIdempotencyStore:
+    """IdempotencyStore on the IdempotencyKey table, shared by every worker using the database.
+
+    Claims are committed on their own connection right away, so the primary
+    key decides the winner between workers.
+    """
+
+    def __init__(self, engine, ttl=86400, lock_ttl=60, purge_interval=300):
+        self.engine = engine
+        self.ttl = datetime.timedelta(seconds=ttl)
+        self.lock_ttl = datetime.timedelta(seconds=lock_ttl)
+        self.purge_interval = purge_interval
+        self._last_purge = time.monotonic()
+
+    def begin(self, key, fingerprint):
+        table = IdempotencyKey.__table__
+        while True:
+            now = datetime.datetime.utcnow()
+            try:
+                with self.engine.begin() as connection:
+                    connection.execute(table.insert().values(key=key, fingerprint=fingerprint,
+                                                             expiresAt=now + self.lock_ttl))
+                self._purge(now)
+                return None
+            except IntegrityError:
+                pass
+            with self.engine.begin() as connection:
+                row = connection.execute(select(table.c.fingerprint, table.c.status, table.c.body,
+                                                table.c.expiresAt).where(table.c.key == key)).first()
+                if row is None:
+                    continue
+                if row.expiresAt >= now:
+                    return row.fingerprint, row.status, row.body
+                # expired record or abandoned claim: take it over, compare-and-swap on expiresAt
+                taken = connection.execute(
+                    update(table).where(table.c.key == key, table.c.expiresAt == row.expiresAt)
+                    .values(fingerprint=fingerprint, status=None, body=None, expiresAt=now + self.lock_ttl))
+                if taken.rowcount:
+                    return None
+
+    def complete(self, key, fingerprint, status, body):
+        table = IdempotencyKey.__table__
+        with self.engine.begin() as connection:
+            connection.execute(update(table).where(table.c.key == key).values(
+                status=status, body=body, expiresAt=datetime.datetime.utcnow() + self.ttl))
+
+    def release(self, key):
+        with self.engine.begin() as connection:
+            connection.execute(delete(IdempotencyKey.__table__).where(IdempotencyKey.key == key))
+
+    def _purge(self, now):
+        if time.monotonic() - self._last_purge < self.purge_interval:
+            return
+        self._last_purge = time.monotonic()
+        with self.engine.begin() as connection:
+            connection.execute(delete(IdempotencyKey.__table__).where(IdempotencyKey.expiresAt < now))
@@ -0,0 +1,166 @@
+import json
+import logging
+import threading
+import time
+from collections import Counter
+
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Histogram:
+    """Cumulative histogram per (method, endpoint), rendered in Prometheus text format."""
+
+    def __init__(self, name, description, buckets):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self.series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self.series.setdefault(labels, [0] * len(self.buckets) + [0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {labels: list(values) for labels, values in self.series.items()}
+
+    def merge(self, series):
+        # adds another process's snapshot into this one
+        with self._lock:
+            for labels, values in series.items():
+                mine = self.series.setdefault(labels, [0] * len(values))
+                for i, value in enumerate(values):
+                    mine[i] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        for (method, endpoint), values in sorted(self.snapshot().items()):
+            labels = f'method="{_label(method)}",endpoint="{_label(endpoint)}"'
+            for bound, count in zip(self.buckets, values):
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {values[-1]}')
+            lines.append(f'{self.name}_sum{{{labels}}} {values[-2]}')
+            lines.append(f'{self.name}_count{{{labels}}} {values[-1]}')
+        return lines
+
+
+def request_histograms():
+    return [Histogram('http_request_duration_seconds', 'Request latency.', DURATION_BUCKETS),
+            Histogram('db_duration_seconds', 'Time spent in SQL per request.', DURATION_BUCKETS),
+            Histogram('db_queries_per_request', 'SQL statements issued per request.', QUERY_BUCKETS)]
+
+
+def render_snapshots(snapshots):
+    """Prometheus text for the sum of several RequestMetrics.snapshot() results."""
+    histograms = request_histograms()
+    for snapshot in snapshots:
+        for histogram in histograms:
+            histogram.merge(snapshot.get(histogram.name, {}))
+    return '\n'.join(line for histogram in histograms for line in histogram.render()) + '\n'
+
+
+class RequestMetrics:
+    """Counts SQL statements and DB time per request.
+
+    Adds a Server-Timing header to every response, logs requests slower than
+    SLOW_REQUEST_MS together with their repeated statements, and keeps
+    per-endpoint histograms served by GET /metrics.
+    """
+
+    def __init__(self, app, engine):
+        self.slow_request_ms = app.config['SLOW_REQUEST_MS']
+        self.histograms = request_histograms()
+        self.duration, self.db_duration, self.queries = self.histograms
+
+        self.watch(engine)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.add_url_rule('/metrics', 'metrics', self.metrics_view, methods=['GET'])
+        app.extensions['request_metrics'] = self
+
+    def watch(self, engine):
+        """Counts the statements of another engine too, e.g. a read replica."""
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+        event.listen(engine, 'handle_error', self._handle_error)
+
+    # the start time rides on the execution context, so a statement that raises leaves nothing behind;
+    # context is None for the few statements SQLAlchemy issues on its own, e.g. at first connect
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._query_started = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self._count(context, statement)
+
+    def _handle_error(self, exception_context):
+        # a failed statement still cost a round trip
+        if exception_context.statement is not None:
+            self._count(exception_context.execution_context, exception_context.statement)
+
+    def _count(self, context, statement):
+        started = getattr(context, '_query_started', None)
+        if started is None:
+            return
+        del context._query_started
+        if has_request_context() and 'sql_statements' in g:
+            g.sql_time += time.perf_counter() - started
+            g.sql_statements[statement] += 1
+
+    def _before_request(self):
+        g.request_started = time.perf_counter()
+        g.sql_time = 0.0
+        g.sql_statements = Counter()
+
+    def _after_request(self, response):
+        if 'request_started' not in g:
+            return response
+        elapsed = time.perf_counter() - g.request_started
+        queries = sum(g.sql_statements.values())
+        labels = (request.method, request.url_rule.rule if request.url_rule else 'unmatched')
+        self.duration.observe(labels, elapsed)
+        self.db_duration.observe(labels, g.sql_time)
+        self.queries.observe(labels, queries)
+
+        response.headers.add('Server-Timing', f'db;dur={g.sql_time * 1000:.2f};desc="{queries} queries"')
+        response.headers.add('Server-Timing', f'total;dur={elapsed * 1000:.2f}')
+
+        if elapsed * 1000 >= self.slow_request_ms:
+            logger.warning(json.dumps({
+                "event": "slow_request",
+                "method": request.method,
+                "path": request.path,
+                "endpoint": labels[1],
+                "status": response.status_code,
+                "durationMs": round(elapsed * 1000, 2),
+                "dbMs": round(g.sql_time * 1000, 2),
+                "queries": queries,
+                # the same statement issued over and over is usually an N+1
+                "repeated": [{"statement": s, "count": n} for s, n in g.sql_statements.most_common(5) if n > 1],
+            }))
+        return response
+
+    def snapshot(self):
+        return {histogram.name: histogram.snapshot() for histogram in self.histograms}
+
+    def render(self):
+        return '\n'.join(line for histogram in self.histograms for line in histogram.render()) + '\n'
+
+    def metrics_view(self):
+        return Response(self.render(), mimetype='text/plain; version=0.0.4')
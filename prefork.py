@@ -0,0 +1,403 @@
+"""Pre-forked multi-process server for create_app().
+
+The parent builds the app once (schemas, JWT, hasher, metrics, URL map),
+drops its DB connections, binds the listening socket and forks waitress
+workers that share it, so every worker starts warm and opens its own DB
+pool on first use.
+
+    python prefork.py --port 8080 --workers 4 --metrics-port 9100
+
+SIGHUP replaces the workers one at a time, each old worker finishing its
+in-flight requests first; SIGTERM or SIGINT stops all of them the same way.
+GET /metrics on --metrics-port sums the histograms of every worker.
+
+Workers share nothing but the socket. Logouts and evictions from the cached
+users (USER_CACHE_TTL) are relayed to every worker through the parent,
+Idempotency-Key records are kept in the database, and the loan response
+cache is turned off unless --redis-url gives the workers a common backend,
+which then also holds the RATE_LIMITS buckets and the read replica
+stickiness (without it each worker keeps its own). Each worker has a pool
+of DB_POOL_SIZE + DB_MAX_OVERFLOW connections.
+"""
+import argparse
+import gc
+import json
+import os
+import signal
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import Pipe
+from multiprocessing.connection import wait
+
+from waitress import wasyncore
+from waitress.channel import HTTPChannel
+from waitress.server import create_server
+
+from cache import RedisBackend, RevocationStore, TTLCache
+from main import create_app
+from metrics import render_snapshots
+from ratelimit import RedisBuckets
+
+
+class Relay:
+    """The worker's end of its events pipe, shared by the stores whose changes the parent forwards."""
+
+    def __init__(self):
+        self.connection = None
+        self._lock = threading.Lock()
+
+    def send(self, message):
+        if self.connection is not None:
+            with self._lock:
+                self.connection.send(message)
+
+
+class RelayedRevocationStore(RevocationStore):
+    """Revocation store whose revocations are forwarded to the other workers by the parent."""
+
+    def __init__(self, relay):
+        super().__init__()
+        self.relay = relay
+
+    def revoke(self, jti, expires_at, relay=True):
+        super().revoke(jti, expires_at)
+        if relay:
+            self.relay.send(('revoke', jti, expires_at))
+
+
+class RelayedTTLCache(TTLCache):
+    """User cache whose evictions are forwarded to the other workers by the parent."""
+
+    def __init__(self, relay, maxsize=1024, ttl=60):
+        super().__init__(maxsize, ttl)
+        self.relay = relay
+
+    def pop(self, key, default=None, relay=True):
+        if relay:
+            self.relay.send(('evict', key))
+        return super().pop(key, default)
+
+
+class Worker:
+    def __init__(self, pid, control, events):
+        self.pid = pid
+        self.control = control
+        self.events = events
+        self.lock = threading.Lock()
+        self.ready = False
+        self.retiring = False
+
+    def send(self, message):
+        try:
+            with self.lock:
+                self.control.send(message)
+        except OSError:
+            pass
+
+    def snapshot(self, timeout=2):
+        try:
+            with self.lock:
+                self.control.send(('metrics',))
+                if self.control.poll(timeout):
+                    return self.control.recv()
+        except (OSError, EOFError):
+            pass
+        return None
+
+
+def _engine(app):
+    with app.app_context():
+        return app.extensions['sqlalchemy'].db.engine
+
+
+def _drained(server):
+    return not any(channel.requests or channel.total_outbufs_len
+                   for channel in list(server._map.values()) if isinstance(channel, HTTPChannel))
+
+
+def serve_worker(app, sock, threads, grace, control, events):
+    stopping = threading.Event()
+
+    def stop(signum, frame):
+        # the first SIGTERM starts draining, the second one leaves the loop
+        if stopping.is_set():
+            raise SystemExit
+        stopping.set()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    # a fresh pool: connections must never be shared with the parent or siblings
+    _engine(app).dispose()
+    if app.extensions['read_replicas'] is not None:
+        app.extensions['read_replicas'].dispose()
+    store = app.extensions['revocation_store']
+    user_cache = app.extensions['user_cache']
+    for relayed in (store, user_cache):
+        if isinstance(relayed, (RelayedRevocationStore, RelayedTTLCache)):
+            relayed.relay.connection = events
+    metrics = app.extensions['request_metrics']
+    server = create_server(app, sockets=[sock], threads=threads)
+
+    def control_loop():
+        while True:
+            try:
+                message = control.recv()
+            except (EOFError, OSError):
+                return
+            if message[0] == 'metrics':
+                control.send(metrics.snapshot())
+            elif message[0] == 'revoke':
+                store.revoke(*message[1:], relay=False)
+            elif message[0] == 'evict':
+                user_cache.pop(message[1], relay=False)
+
+    def shutdown():
+        stopping.wait()
+        # stop accepting, let in-flight requests finish, then leave the loop
+        server.trigger.pull_trigger(lambda: wasyncore.dispatcher.close(server))
+        deadline = time.monotonic() + grace
+        while time.monotonic() < deadline and not _drained(server):
+            time.sleep(0.05)
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    threading.Thread(target=control_loop, daemon=True).start()
+    threading.Thread(target=shutdown, daemon=True).start()
+    events.send(('ready',))
+    try:
+        server.run()
+    finally:
+        app.extensions['hasher'].shutdown()
+        # workers leave with os._exit, so atexit never flushes the queue
+        if app.extensions['write_behind'] is not None:
+            app.extensions['write_behind'].close()
+        _engine(app).dispose()
+
+
+class Arbiter:
+    """Keeps `workers` forked processes serving `sock`, restarting them on SIGHUP."""
+
+    def __init__(self, app, sock, workers, threads, grace, revocation_store):
+        self.app = app
+        self.sock = sock
+        self.size = workers
+        self.threads = threads
+        self.grace = grace
+        self.revocation_store = revocation_store
+        self.workers = {}
+        self.metrics_server = None
+        self.restarts = 0
+        self.running = True
+        self.reloading = False
+
+    def spawn(self):
+        control, child_control = Pipe()
+        events, child_events = Pipe(duplex=False)
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                for worker in self.workers.values():
+                    worker.control.close()
+                    worker.events.close()
+                if self.metrics_server is not None:
+                    self.metrics_server.socket.close()
+                control.close()
+                events.close()
+                serve_worker(self.app, self.sock, self.threads, self.grace, child_control, child_events)
+            except BaseException as e:
+                print(e)
+                status = 1
+            finally:
+                os._exit(status)
+        child_control.close()
+        child_events.close()
+        worker = self.workers[pid] = Worker(pid, control, events)
+        return worker
+
+    def handle(self, worker, message):
+        if message[0] == 'ready':
+            worker.ready = True
+        elif message[0] in ('revoke', 'evict'):
+            if message[0] == 'revoke':
+                # the parent keeps a copy too, so workers forked later start with it
+                self.revocation_store.revoke(*message[1:], relay=False)
+            for other in list(self.workers.values()):
+                if other is not worker:
+                    other.send(message)
+
+    def pump(self, timeout):
+        # handle worker messages for up to `timeout` seconds and reap exited workers
+        connections = {worker.events: worker for worker in self.workers.values() if not worker.events.closed}
+        for connection in wait(list(connections), timeout):
+            worker = connections[connection]
+            try:
+                self.handle(worker, connection.recv())
+            except (EOFError, OSError):
+                connection.close()
+        self.reap()
+
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            worker = self.workers.pop(pid, None)
+            if worker is None:
+                continue
+            worker.control.close()
+            worker.events.close()
+            if self.running and not worker.retiring:
+                print(f"worker {pid} exited with status {status}, starting a new one")
+                self.restarts += 1
+                self.spawn()
+
+    def wait_for(self, condition, timeout):
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            self.pump(0.1)
+        return condition()
+
+    def retire(self, workers):
+        for worker in workers:
+            worker.retiring = True
+            try:
+                os.kill(worker.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        if not self.wait_for(lambda: not any(w.pid in self.workers for w in workers), self.grace + 5):
+            for worker in workers:
+                if worker.pid in self.workers:
+                    os.kill(worker.pid, signal.SIGKILL)
+            self.wait_for(lambda: not any(w.pid in self.workers for w in workers), 5)
+
+    def rolling_restart(self):
+        for old in [worker for worker in self.workers.values() if not worker.retiring]:
+            if not self.running:
+                return
+            new = self.spawn()
+            self.wait_for(lambda: new.ready or new.pid not in self.workers, 30)
+            self.retire([old])
+            self.restarts += 1
+        print(f"restarted, {len(self.workers)} workers")
+
+    def render_metrics(self):
+        workers = [worker for worker in list(self.workers.values()) if worker.ready]
+        snapshots = [snapshot for snapshot in (worker.snapshot() for worker in workers) if snapshot is not None]
+        lines = ["# HELP prefork_workers Workers ready to serve.", "# TYPE prefork_workers gauge",
+                 f"prefork_workers {len(workers)}",
+                 "# HELP prefork_restarts_total Workers replaced since start.",
+                 "# TYPE prefork_restarts_total counter",
+                 f"prefork_restarts_total {self.restarts}"]
+        return render_snapshots(snapshots) + '\n'.join(lines) + '\n'
+
+    def serve_metrics(self, host, port):
+        arbiter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = arbiter.render_metrics().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.metrics_server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self.metrics_server.serve_forever, daemon=True).start()
+
+    def stop(self, signum, frame):
+        self.running = False
+
+    def reload(self, signum, frame):
+        self.reloading = True
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGHUP, self.reload)
+        for _ in range(self.size):
+            self.spawn()
+        if self.wait_for(lambda: all(worker.ready for worker in self.workers.values()), 30):
+            print(f"{len(self.workers)} workers ready")
+        while self.running:
+            if self.reloading:
+                self.reloading = False
+                self.rolling_restart()
+            self.pump(0.5)
+        self.retire(list(self.workers.values()))
+
+
+def parse_setting(setting):
+    key, _, value = setting.partition('=')
+    try:
+        return key, json.loads(value)
+    except ValueError:
+        return key, value
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--threads', type=int, default=4, help="waitress threads per worker")
+    parser.add_argument('--grace', type=float, default=30, help="seconds a stopping worker may spend on in-flight requests")
+    parser.add_argument('--backlog', type=int, default=1024)
+    parser.add_argument('--metrics-port', type=int, help="serve the summed /metrics of all workers on this port")
+    parser.add_argument('--redis-url', help="share the loan response cache, rate limits and read-your-writes marks between workers")
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE',
+                        help="override an app config value, VALUE parsed as JSON when possible")
+    args = parser.parse_args()
+
+    relay = Relay()
+    revocation_store = RelayedRevocationStore(relay)
+    config = dict(parse_setting(setting) for setting in args.set)
+    config['TOKEN_REVOCATION_STORE'] = revocation_store
+    config['USER_CACHE'] = RelayedTTLCache(relay, maxsize=config.get('USER_CACHE_SIZE', 1024),
+                                           ttl=config.get('USER_CACHE_TTL', 60))
+    if args.redis_url:
+        import redis
+        client = redis.Redis.from_url(args.redis_url)
+        config['RESPONSE_CACHE_BACKEND'] = RedisBackend(client, ttl=config.get('RESPONSE_CACHE_TTL', 300))
+        config['RATE_LIMIT_BACKEND'] = RedisBuckets(client)
+        config['READ_REPLICA_STICKY_BACKEND'] = RedisBackend(client)
+    elif args.workers > 1:
+        config['RESPONSE_CACHE_ENABLED'] = False
+    if args.workers > 1:
+        config.setdefault('IDEMPOTENCY_STORE', 'database')
+        # every worker has its own bcrypt pool; share the cores out instead of cores per worker
+        config.setdefault('HASH_WORKERS', max(1, (os.cpu_count() or 1) // args.workers))
+
+    app = create_app(config)
+    app.url_map.update()
+    _engine(app).dispose()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(args.backlog)
+    sock.setblocking(False)
+
+    arbiter = Arbiter(app, sock, args.workers, args.threads, args.grace, revocation_store)
+    if args.metrics_port is not None:
+        arbiter.serve_metrics(args.host, args.metrics_port)
+    # keep the warm heap out of the collector so forked workers share its pages
+    gc.freeze()
+    arbiter.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+import json
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from flask import request
+from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+from werkzeug.wsgi import ClosingIterator
+
+
+class MemoryBuckets:
+    """Token buckets of one process, the least recently used dropped beyond `maxsize`."""
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst):
+        """Takes a token; returns (allowed, seconds until the next token)."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return allowed, (1 - tokens) / rate
+
+
+# refill and take in one round trip on redis time, so every worker sees the same bucket
+_TAKE = """
+local rate, burst = tonumber(ARGV[1]), tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = math.min(burst, (tonumber(state[1]) or burst) + (now - (tonumber(state[2]) or now)) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return {allowed, tostring((1 - tokens) / rate)}
+"""
+
+
+class RedisBuckets:
+    """Token buckets shared by every worker, on any redis-py compatible client."""
+
+    def __init__(self, client, prefix="ap4:rate:"):
+        self.prefix = prefix
+        self._take = client.register_script(_TAKE)
+
+    def take(self, key, rate, burst):
+        allowed, wait = self._take(keys=[self.prefix + key], args=[rate, burst])
+        return bool(allowed), float(wait)
+
+
+class RateLimiter:
+    """Rejects requests over their route's limit with 429, before the view runs.
+
+    `limits` maps endpoint names to (rate, burst): a bucket of `burst` tokens
+    refilled at `rate` per second, one bucket per endpoint and client; "*"
+    covers every endpoint not listed. The client is the JWT identity when the
+    request carries a valid token and the remote address otherwise, so
+    nothing touches the database or bcrypt before the check.
+    """
+
+    def __init__(self, app, limits, store):
+        # both buckets divide by the rate, and a burst below one token admits nothing
+        for endpoint, (rate, burst) in limits.items():
+            if rate <= 0 or burst < 1:
+                raise ValueError(f"RATE_LIMITS[{endpoint!r}] needs a rate above 0 and a burst of at least 1")
+        self.limits = limits
+        self.store = store
+        self.rejected = 0
+        app.before_request(self._before_request)
+        app.extensions['rate_limiter'] = self
+
+    def _client(self):
+        try:
+            verify_jwt_in_request(optional=True)
+            identity = get_jwt_identity()
+        except Exception:
+            identity = None
+        return f"user:{identity}" if identity is not None else f"ip:{request.remote_addr}"
+
+    def _before_request(self):
+        limit = self.limits.get(request.endpoint, self.limits.get('*'))
+        if limit is None:
+            return None
+        allowed, wait = self.store.take(f"{request.endpoint}:{self._client()}", *limit)
+        if allowed:
+            return None
+        self.rejected += 1
+        return {"message": "Too many requests"}, 429, {'Retry-After': str(max(1, math.ceil(wait)))}
+
+
+class ConcurrencyLimit:
+    """WSGI middleware letting at most `limit` requests into the app at once.
+
+    Up to `queue` more wait as long as `timeout` seconds for a slot; the rest
+    are shed with 503 right away. A slot is held until the response body is
+    closed, so streamed responses count until they finish.
+    """
+
+    def __init__(self, wsgi_app, limit, queue=0, timeout=1.0, retry_after=1):
+        self.wsgi_app = wsgi_app
+        self.queue = queue
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.shed = 0
+        self._slots = threading.BoundedSemaphore(limit)
+        self._waiting = 0
+        self._lock = threading.Lock()
+
+    def _admit(self):
+        if self._slots.acquire(blocking=False):
+            return True
+        with self._lock:
+            if self._waiting >= self.queue:
+                return False
+            self._waiting += 1
+        try:
+            return self._slots.acquire(timeout=self.timeout)
+        finally:
+            with self._lock:
+                self._waiting -= 1
+
+    def __call__(self, environ, start_response):
+        if not self._admit():
+            self.shed += 1
+            body = json.dumps({"message": "Service is busy, try again later"}).encode() + b"\n"
+            start_response('503 SERVICE UNAVAILABLE', [('Content-Type', 'application/json'),
+                                                       ('Content-Length', str(len(body))),
+                                                       ('Retry-After', str(self.retry_after))])
+            return [body]
+        try:
+            result = self.wsgi_app(environ, start_response)
+        except BaseException:
+            self._slots.release()
+            raise
+        return ClosingIterator(result, self._slots.release)
@@ -0,0 +1,78 @@
+import itertools
+import time
+
+from flask import g, has_request_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import create_engine, orm
+from sqlalchemy.exc import DBAPIError
+
+from cache import TTLCache
+from config import engine_options
+
+
+class RoutingSession(SignallingSession):
+    """Sends the SELECTs of a request to g.read_engine when one is set; flushes and DML go to the primary."""
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        engine = g.get('read_engine') if has_request_context() else None
+        if engine is not None and not self._flushing and not getattr(clause, 'is_dml', False):
+            return engine
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+class ReplicaRouter:
+    """Read replicas taken round-robin, with read-your-writes stickiness.
+
+    A replica that fails to connect sits out for `retry_after` seconds and
+    is tried again by the next request after that; with every replica out,
+    reads stay on the primary. `stick(identity)` keeps that identity's
+    reads on the primary for `sticky_seconds`, long enough for replication
+    to catch up with its own writes. The sticky marks live in `sticky_backend`
+    (get/set like TTLCache or RedisBackend) so several workers can share them.
+    """
+
+    def __init__(self, uris, retry_after=30, sticky_seconds=5, sticky_backend=None):
+        self.engines = [create_engine(uri, **engine_options(uri)) for uri in uris]
+        self.retry_after = retry_after
+        self.sticky_seconds = sticky_seconds
+        self._sticky = sticky_backend or TTLCache(maxsize=100000, ttl=sticky_seconds)
+        self._down = {}
+        self._next = itertools.count()
+
+    def stick(self, identity):
+        self._sticky.set(f"sticky:{identity}", True, ttl=self.sticky_seconds)
+
+    def is_sticky(self, identity):
+        return self._sticky.get(f"sticky:{identity}") is not None
+
+    def connect(self, session):
+        """Opens `session`'s connection on the next healthy replica and returns its engine, None if all are down."""
+        now = time.monotonic()
+        for _ in range(len(self.engines)):
+            index = next(self._next) % len(self.engines)
+            if self._down.get(index, 0) > now:
+                continue
+            engine = self.engines[index]
+            try:
+                session.connection(bind_arguments={"bind": engine})
+            except DBAPIError as e:
+                print(e)
+                self._down[index] = now + self.retry_after
+                continue
+            self._down.pop(index, None)
+            return engine
+        return None
+
+    def status(self):
+        now = time.monotonic()
+        return [{"url": engine.url.render_as_string(hide_password=True), "up": self._down.get(index, 0) <= now}
+                for index, engine in enumerate(self.engines)]
+
+    def dispose(self):
+        for engine in self.engines:
+            engine.dispose()
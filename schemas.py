@@ -0,0 +1,47 @@
+from marshmallow import Schema, fields
+from marshmallow.validate import Length, Range
+
+
+class UserSchema(Schema):
+    phone = fields.Str(validate=Length(equal=12), required=True)
+    password = fields.Str(validate=Length(min=6, max=32), required=True)
+    firstName = fields.Str(validate=Length(min=3, max=32), required=True)
+    lastName = fields.Str(validate=Length(min=3, max=32), required=True)
+    age = fields.Int(strict=True, validate=[Range(min=18, error="Age must be greater or equal to 18")],
+                     required=True)
+    monthlyEarnings = fields.Int(required=True)
+    occupation = fields.Str(validate=Length(max=32), required=True)
+    isAdmin = fields.Bool(required=True)
+
+
+class UserDisplaySchema(Schema):
+    class Meta:
+        fields = ("phone", "firstName", "lastName", "age", "monthlyEarnings", "occupation")
+
+
+class LoanSchema(Schema):
+    amount = fields.Int(strict=True, validate=[Range(min=1, error="Amount must be greater or equal to 1")],
+                        required=True)
+    isPaid = fields.Bool(required=True)
+    createdDate = fields.Int(required=True, validate=[Range(min=1)])
+    months = fields.Int(strict=True, validate=[Range(min=1)], required=True)
+
+
+class LoanDisplaySchema(Schema):
+    class Meta:
+        fields = ("loanId", "amount", "isPaid", "createdDate", "months", "userId", "payments")
+
+
+class PaymentSchema(Schema):
+    amount = fields.Int(strict=True, validate=[Range(min=1, error="Amount must be greater or equal to 1")],
+                        required=True)
+    paidDate = fields.Int(required=True)
+
+
+class PaymentBatchSchema(PaymentSchema):
+    loanId = fields.Int(strict=True, required=True)
+
+
+class PaymentDisplaySchema(Schema):
+    class Meta:
+        fields = ("paymentId", "amount", "paidDate", "loanId")
@@ -0,0 +1,86 @@
+import json
+
+from flask import current_app, jsonify
+
+from models import User, Loan, Payment
+
+
+def _isoformat(value):
+    return value.isoformat()
+
+
+class RowSerializer:
+    """Builds response dicts straight from row tuples.
+
+    `fields` are (key, column) or (key, column, convert) in the order the
+    columns are selected; a None column takes its value from the extra
+    arguments of `one`. Fields are kept in sorted key order, so the dicts
+    encode without key sorting and match jsonify of the marshmallow display
+    schemas.
+    """
+
+    def __init__(self, *fields):
+        self.columns = [column for _, column, *_ in fields if column is not None]
+        # (key, taken from extra, position, convert or None)
+        self.fields = []
+        index = extra = 0
+        for key, column, *convert in fields:
+            if column is None:
+                self.fields.append((key, True, extra, None))
+                extra += 1
+            else:
+                self.fields.append((key, False, index, convert[0] if convert else None))
+                index += 1
+        self.fields.sort(key=lambda field: field[0])
+
+    def one(self, row, *extra):
+        result = {}
+        for key, from_extra, position, convert in self.fields:
+            value = extra[position] if from_extra else row[position]
+            result[key] = value if convert is None else convert(value)
+        return result
+
+    def many(self, rows):
+        one = self.one
+        return [one(row) for row in rows]
+
+
+USER_DISPLAY = RowSerializer(
+    ("phone", User.phone), ("firstName", User.firstName), ("lastName", User.lastName), ("age", User.age),
+    ("monthlyEarnings", User.monthlyEarnings), ("occupation", User.occupation))
+
+LOAN_DISPLAY = RowSerializer(
+    ("loanId", Loan.loanId), ("amount", Loan.amount), ("isPaid", Loan.isPaid),
+    ("createdDate", Loan.createdDate, _isoformat), ("months", Loan.months), ("userId", Loan.userId),
+    ("payments", None))
+
+# loans listed without their payment ids
+LOANS_DISPLAY = RowSerializer(
+    ("loanId", Loan.loanId), ("amount", Loan.amount), ("isPaid", Loan.isPaid),
+    ("createdDate", Loan.createdDate, _isoformat), ("months", Loan.months), ("userId", Loan.userId))
+
+PAYMENT_DISPLAY = RowSerializer(
+    ("paymentId", Payment.paymentId), ("amount", Payment.amount), ("paidDate", Payment.paidDate, _isoformat),
+    ("loanId", Payment.loanId))
+
+_encoders = {ensure_ascii: json.JSONEncoder(ensure_ascii=ensure_ascii, separators=(",", ":"))
+             for ensure_ascii in (True, False)}
+
+
+def _json_settings(app):
+    # Flask 2.2+ keeps these on the JSON provider, older versions in the config
+    provider = getattr(app, "json", None)
+    if provider is None:
+        config = app.config
+        return (config.get("JSONIFY_PRETTYPRINT_REGULAR", False), config.get("JSON_SORT_KEYS", True),
+                config.get("JSON_AS_ASCII", True), config.get("JSONIFY_MIMETYPE", "application/json"))
+    return provider.compact is False, provider.sort_keys, provider.ensure_ascii, provider.mimetype
+
+
+def json_response(result):
+    """jsonify() for values built by RowSerializer, using the C encoder without key sorting."""
+    pretty, sort_keys, ensure_ascii, mimetype = _json_settings(current_app)
+    if current_app.debug or pretty or not sort_keys:
+        return jsonify(result)
+    body = _encoders[bool(ensure_ascii)].encode(result) + "\n"
+    return current_app.response_class(body, mimetype=mimetype)
@@ -0,0 +1,85 @@
+from sqlalchemy import and_, case, delete, func, insert, literal, not_, select, update
+from sqlalchemy.exc import IntegrityError
+
+from models import Loan, UserSummary
+
+FIELDS = ("totalBorrowed", "totalPaid", "outstanding", "openLoans", "paidLoans", "nextDue")
+
+
+def _installment(amount, months):
+    # equal monthly installments; nextDue sums them over the open loans
+    return func.round(amount * 1.0 / months, 2)
+
+
+def aggregate(user_id):
+    # one GROUP BY over the user's loans; paidTotal already holds each loan's payments
+    is_open = not_(Loan.isPaid)
+    return select(
+        Loan.userId,
+        func.coalesce(func.sum(Loan.amount), 0).label("totalBorrowed"),
+        func.coalesce(func.sum(Loan.paidTotal), 0).label("totalPaid"),
+        func.coalesce(func.sum(case((and_(is_open, Loan.amount > Loan.paidTotal), Loan.amount - Loan.paidTotal),
+                                    else_=0)), 0).label("outstanding"),
+        func.coalesce(func.sum(case((is_open, 1), else_=0)), 0).label("openLoans"),
+        func.coalesce(func.sum(case((is_open, 0), else_=1)), 0).label("paidLoans"),
+        func.coalesce(func.sum(case((is_open, _installment(Loan.amount, Loan.months)), else_=0)), 0).label("nextDue"),
+    ).where(Loan.userId == user_id).group_by(Loan.userId)
+
+
+def _as_dict(user_id, row):
+    result = {"userId": user_id}
+    for name in FIELDS:
+        value = getattr(row, name) if row is not None else 0
+        result[name] = float(value) if name == "nextDue" else int(value)
+    return result
+
+
+def load(session, user_id, materialized=True):
+    if not materialized:
+        return _as_dict(user_id, session.execute(aggregate(user_id)).first())
+
+    columns = [getattr(UserSummary, name) for name in FIELDS]
+    row = session.execute(select(*columns).where(UserSummary.userId == user_id)).first()
+    if row is None:
+        # build the row lazily; INSERT ... SELECT reads and writes in one statement.
+        # A user without loans gets a row of zeros, so later reads stay read-only;
+        # for an unknown user the foreign key rejects it and the zeros are returned as before
+        try:
+            built = session.execute(insert(UserSummary).from_select(["userId", *FIELDS], aggregate(user_id)))
+            if built.rowcount == 0:
+                session.execute(insert(UserSummary).values(_as_dict(user_id, None)))
+            session.commit()
+        except IntegrityError:
+            session.rollback()
+        row = session.execute(select(*columns).where(UserSummary.userId == user_id)).first()
+    return _as_dict(user_id, row)
+
+
+# the statements below are executed by the caller inside its own transaction,
+# so both the sync app and the async one can use them
+
+def _update(user_id, **values):
+    # users without a row yet are skipped: load() builds it from Loan on first read
+    return update(UserSummary).where(UserSummary.userId == user_id).values(
+        {getattr(UserSummary, name): getattr(UserSummary, name) + value for name, value in values.items()}
+    ).execution_options(synchronize_session=False)
+
+
+def apply_loan(user_id, amount, months, is_paid):
+    if is_paid:
+        return _update(user_id, totalBorrowed=amount, paidLoans=1)
+    return _update(user_id, totalBorrowed=amount, outstanding=amount, openLoans=1,
+                   nextDue=_installment(literal(amount), months))
+
+
+def apply_payment(loan, amount):
+    # `loan` holds the state before this payment was applied
+    remaining = max(loan.amount - loan.paidTotal, 0)
+    if amount >= remaining:
+        return _update(loan.userId, totalPaid=amount, outstanding=-remaining, openLoans=-1, paidLoans=1,
+                       nextDue=-_installment(literal(loan.amount), loan.months))
+    return _update(loan.userId, totalPaid=amount, outstanding=-amount)
+
+
+def invalidate(user_ids):
+    return delete(UserSummary).where(UserSummary.userId.in_(user_ids)).execution_options(synchronize_session=False)
@@ -0,0 +1,81 @@
+import os
+import threading
+from collections import defaultdict
+
+from sqlalchemy import bindparam
+
+
+class WriteBehind:
+    """Non-critical writes, flushed in batches from a background thread.
+
+    `insert(table, row)` queues a row for a bulk INSERT; `update(table, key, **values)`
+    keeps only the newest values per primary key and applies them with one
+    executemany UPDATE. A flush happens every `interval` seconds, or sooner
+    once `batch_size` writes are waiting. Writes queued while `max_pending`
+    are already waiting are dropped and counted, and anything still queued
+    when the process dies without `close()` is lost.
+    """
+
+    def __init__(self, engine, interval=1.0, batch_size=500, max_pending=10000):
+        self.engine = engine
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.dropped = 0
+        self._inserts = defaultdict(list)
+        self._updates = defaultdict(dict)
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pid = None
+
+    def _queue(self):
+        # the thread starts on first use, and again in a forked child
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, daemon=True).start()
+        if self._pending >= self.max_pending:
+            self.dropped += 1
+            return False
+        self._pending += 1
+        if self._pending >= self.batch_size:
+            self._wakeup.set()
+        return True
+
+    def insert(self, table, row):
+        with self._lock:
+            if self._queue():
+                self._inserts[table].append(row)
+
+    def update(self, table, key, **values):
+        with self._lock:
+            if self._queue():
+                self._updates[table, tuple(sorted(values))][key] = values
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            inserts, self._inserts = self._inserts, defaultdict(list)
+            updates, self._updates = self._updates, defaultdict(dict)
+            self._pending = 0
+        if not inserts and not updates:
+            return
+        try:
+            with self.engine.begin() as connection:
+                for table, rows in inserts.items():
+                    connection.execute(table.insert(), rows)
+                for (table, names), rows in updates.items():
+                    key = list(table.primary_key.columns)[0]
+                    statement = table.update().where(key == bindparam('_key')).values(
+                        {name: bindparam(name) for name in names})
+                    connection.execute(statement, [dict(values, _key=k) for k, values in rows.items()])
+        except Exception as e:
+            print(e)
+
+    def close(self):
+        self.flush()